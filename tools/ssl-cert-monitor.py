@@ -11,13 +11,108 @@ import json
 import os
 import sys
 import subprocess
-import argparse
+import atexit
+import time
+import calendar
+import hashlib
+import tempfile
+import asyncio
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from urllib.parse import urlparse
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# cryptography is optional and only imported once a certificate is parsed
+_x509 = None
+_x509_checked = False
+_NAME_OIDS = {}
+
+def _load_x509():
+    """Import cryptography's x509 module on first use; None if unavailable"""
+    global _x509, _x509_checked, _NAME_OIDS
+    if not _x509_checked:
+        _x509_checked = True
+        try:
+            from cryptography import x509
+            from cryptography.x509.oid import NameOID
+        except ImportError:
+            return None
+        
+        # OpenSSL long names, matching the keys the stdlib getpeercert() uses
+        _NAME_OIDS = {
+            NameOID.COMMON_NAME: 'commonName',
+            NameOID.COUNTRY_NAME: 'countryName',
+            NameOID.STATE_OR_PROVINCE_NAME: 'stateOrProvinceName',
+            NameOID.LOCALITY_NAME: 'localityName',
+            NameOID.ORGANIZATION_NAME: 'organizationName',
+            NameOID.ORGANIZATIONAL_UNIT_NAME: 'organizationalUnitName',
+            NameOID.SERIAL_NUMBER: 'serialNumber',
+            NameOID.EMAIL_ADDRESS: 'emailAddress',
+            NameOID.DOMAIN_COMPONENT: 'domainComponent',
+            NameOID.BUSINESS_CATEGORY: 'businessCategory',
+        }
+        _x509 = x509
+    return _x509
+
+_MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
+}
+
+def _parse_cert_time(value):
+    """Convert an OpenSSL time string ('Jan  5 09:00:00 2027 GMT') to epoch seconds"""
+    parts = value.split()
+    hour, minute, second = map(int, parts[2].split(':'))
+    return calendar.timegm((int(parts[3]), _MONTHS[parts[0]], int(parts[1]),
+                            hour, minute, second, 0, 0, 0))
+
+def _write_json_atomic(path, data):
+    """Write data as JSON to path via a temp file so readers never see a partial file"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def _san_covers(san_domains, hostname):
+    """Check whether a certificate's DNS SAN entries are valid for hostname"""
+    hostname = hostname.lower()
+    for kind, name in san_domains:
+        if kind != 'DNS':
+            continue
+        name = name.lower()
+        if name == hostname:
+            return True
+        if name.startswith('*.') and hostname.partition('.')[2] == name[2:]:
+            return True
+    return False
+
 class SSLCertMonitor:
-    def __init__(self, config_file='/etc/ssl-monitor/config.json'):
+    def __init__(self, config_file='/etc/ssl-monitor/config.json', use_cache=True):
         self.config = self.load_config(config_file)
+        if self.config['log_format'] == 'msgpack' and msgpack is None:
+            print("Warning: msgpack is not installed, logging as JSON instead")
+            self.config['log_format'] = 'json'
+        self.use_cache = use_cache
+        self._cache_file = self.config['cache_file']
+        self._cache = self.load_cache()
+        self._ssl_ctx = ssl.create_default_context()
+        self._by_fingerprint = {}
+        self._peer_addresses = {}
+        self._log_fp = None
+        self._renew_backoff_file = self.config['renew_backoff_file']
+        self._renew_backoff = self.load_renew_backoff()
+        atexit.register(self.save_cache)
+        atexit.register(self.save_renew_backoff)
         
     def load_config(self, config_file):
         """Load configuration from file or use defaults"""
@@ -33,7 +128,12 @@ class SSLCertMonitor:
             "email_alerts": os.environ.get('ALERT_EMAIL', ''),
             "auto_renew": False,
             "certbot_email": os.environ.get('CERTBOT_EMAIL', ''),
-            "log_file": "/var/log/ssl-monitor.log"
+            "log_file": "/var/log/ssl-monitor.log",
+            "log_format": "json",
+            "cache_file": "/var/cache/ssl-monitor/cache.json",
+            "max_cache_entries": 10000,
+            "max_concurrency": 64,
+            "renew_backoff_file": "/var/cache/ssl-monitor/renew-backoff.json"
         }
         
         if os.path.exists(config_file):
@@ -46,49 +146,301 @@ class SSLCertMonitor:
         
         return default_config
     
+    def load_cache(self):
+        """Load cached certificate probes from disk, oldest first"""
+        cache = OrderedDict()
+        if not self._cache_file or not os.path.exists(self._cache_file):
+            return cache
+        
+        try:
+            with open(self._cache_file, 'r') as f:
+                cache.update(json.load(f))
+        except Exception as e:
+            print(f"Warning: Could not load cache file {self._cache_file}: {e}")
+            return OrderedDict()
+        
+        while len(cache) > self.config['max_cache_entries']:
+            cache.popitem(last=False)
+        
+        return cache
+    
+    def save_cache(self):
+        """Persist cached certificate probes to disk"""
+        if not self._cache_file:
+            return
+        
+        try:
+            _write_json_atomic(self._cache_file, self._cache)
+        except Exception as e:
+            print(f"Warning: Could not write cache file {self._cache_file}: {e}")
+    
+    def load_renew_backoff(self):
+        """Load per-domain renewal backoff state from disk"""
+        if not self._renew_backoff_file or not os.path.exists(self._renew_backoff_file):
+            return {}
+        
+        try:
+            with open(self._renew_backoff_file, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not load renewal backoff file {self._renew_backoff_file}: {e}")
+            return {}
+    
+    def save_renew_backoff(self):
+        """Persist per-domain renewal backoff state to disk"""
+        if not self._renew_backoff_file:
+            return
+        
+        # Drop state for domains that are no longer monitored
+        domains = set(self.config['domains'])
+        backoff = {domain: state for domain, state in self._renew_backoff.items()
+                   if domain in domains}
+        
+        try:
+            _write_json_atomic(self._renew_backoff_file, backoff)
+        except Exception as e:
+            print(f"Warning: Could not write renewal backoff file {self._renew_backoff_file}: {e}")
+    
+    def _record_renew_failure(self, domain):
+        """Back off further renewals for domain: 1h, doubling up to 24h"""
+        previous = self._renew_backoff.get(domain)
+        now = time.time()
+        
+        # A failure long after the last retry window (e.g. the cert was renewed
+        # by hand in between) starts a fresh backoff
+        if previous and now - previous['next_retry'] <= previous['delay']:
+            delay = min(previous['delay'] * 2, 86400)
+        else:
+            delay = 3600
+        self._renew_backoff[domain] = {
+            'next_retry': now + delay,
+            'delay': delay
+        }
+    
+    def _minimal_cert_record(self, cert):
+        """Reduce a certificate result to the fields that drive alerting"""
+        return {
+            'domain': cert['domain'],
+            'not_after_epoch': cert['not_after_epoch'],
+            'cert_sha256': cert['cert_sha256'],
+            'fetched_at': cert['fetched_at']
+        }
+    
+    def cache_ttl(self, days_left):
+        """Seconds a cached probe stays fresh, shorter as expiry approaches"""
+        if days_left <= self.config['critical_days']:
+            return 300
+        if days_left <= self.config['warning_days']:
+            return 3600
+        return 86400
+    
+    def cached_cert_info(self, domain, port=443):
+        """Return certificate information from the cache if still fresh"""
+        key = f"{domain}:{port}"
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        
+        self._cache.move_to_end(key)
+        if not self.use_cache:
+            return None
+        
+        now = time.time()
+        not_after_epoch = entry['not_after_epoch']
+        days_left = int(not_after_epoch - now) // 86400
+        
+        if now - entry['fetched_at'] >= self.cache_ttl(days_left):
+            return None
+        
+        return {
+            'domain': domain,
+            'expiry_date': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(not_after_epoch)),
+            'days_until_expiry': days_left,
+            'status': 'valid',
+            'not_after_epoch': not_after_epoch,
+            'cert_sha256': entry['cert_sha256'],
+            'fetched_at': entry['fetched_at']
+        }
+    
+    def store_cert_info(self, cert_info, port=443):
+        """Record a fresh probe result in the cache"""
+        if cert_info['status'] != 'valid':
+            return
+        
+        key = f"{cert_info['domain']}:{port}"
+        self._cache[key] = self._minimal_cert_record(cert_info)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.config['max_cache_entries']:
+            self._cache.popitem(last=False)
+    
     def get_cert_info(self, domain, port=443):
-        """Get SSL certificate information for a domain"""
+        """Get SSL certificate information, using the cache when fresh"""
+        cert_info = self.cached_cert_info(domain, port)
+        if cert_info is not None:
+            return cert_info
+        
+        cert_info = self.fetch_cert_info(domain, port)
+        self.store_cert_info(cert_info, port)
+        return cert_info
+    
+    def _build_cert_info(self, domain, peer):
+        """Build the result dict from a connected SSLSocket or SSLObject"""
+        cert_der = peer.getpeercert(binary_form=True)
+        x509 = _load_x509()
+        
+        if x509 is not None:
+            # Parse the DER certificate in C, touching only the fields we report
+            cert = x509.load_der_x509_certificate(cert_der)
+            if hasattr(cert, 'not_valid_after_utc'):
+                not_after_epoch = int(cert.not_valid_after_utc.timestamp())
+            else:
+                # cryptography < 42 only offers a naive UTC datetime
+                not_after_epoch = calendar.timegm(cert.not_valid_after.utctimetuple())
+            issuer = {_NAME_OIDS.get(attr.oid, attr.oid.dotted_string): attr.value
+                      for attr in cert.issuer}
+            subject = {_NAME_OIDS.get(attr.oid, attr.oid.dotted_string): attr.value
+                       for attr in cert.subject}
+            try:
+                san = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+                san_domains = ([('DNS', name) for name in san.get_values_for_type(x509.DNSName)] +
+                               [('IP Address', str(ip)) for ip in san.get_values_for_type(x509.IPAddress)])
+            except x509.ExtensionNotFound:
+                san_domains = []
+        else:
+            cert = peer.getpeercert()
+            not_after_epoch = _parse_cert_time(cert['notAfter'])
+            issuer = dict(x[0] for x in cert['issuer'])
+            subject = dict(x[0] for x in cert['subject'])
+            san_domains = cert.get('subjectAltName', [])
+        
+        # Calculate days until expiration
+        days_until_expiry = int(not_after_epoch - time.time()) // 86400
+        
+        return {
+            'domain': domain,
+            'issuer': issuer,
+            'subject': subject,
+            'expiry_date': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(not_after_epoch)),
+            'days_until_expiry': days_until_expiry,
+            'status': 'valid',
+            'san_domains': san_domains,
+            'not_after_epoch': not_after_epoch,
+            'cert_sha256': hashlib.sha256(cert_der).hexdigest(),
+            'fetched_at': time.time()
+        }
+    
+    def _error_cert_info(self, domain, error):
+        """Build the result dict for a failed probe"""
+        return {
+            'domain': domain,
+            'error': error,
+            'status': 'error',
+            'days_until_expiry': -1
+        }
+    
+    def fetch_cert_info(self, domain, port=443):
+        """Get SSL certificate information for a domain over the network"""
         try:
-            context = ssl.create_default_context()
             with socket.create_connection((domain, port), timeout=10) as sock:
-                with context.wrap_socket(sock, server_hostname=domain) as ssock:
-                    cert = ssock.getpeercert()
-                    
-                    # Parse expiration date
-                    not_after = cert['notAfter']
-                    expiry_date = datetime.strptime(not_after, '%b %d %H:%M:%S %Y %Z')
-                    
-                    # Calculate days until expiration
-                    days_until_expiry = (expiry_date - datetime.now()).days
-                    
-                    return {
-                        'domain': domain,
-                        'issuer': dict(x[0] for x in cert['issuer']),
-                        'subject': dict(x[0] for x in cert['subject']),
-                        'expiry_date': expiry_date.isoformat(),
-                        'days_until_expiry': days_until_expiry,
-                        'status': 'valid',
-                        'san_domains': cert.get('subjectAltName', [])
-                    }
+                with self._ssl_ctx.wrap_socket(sock, server_hostname=domain) as ssock:
+                    return self._build_cert_info(domain, ssock)
                     
         except Exception as e:
-            return {
-                'domain': domain,
-                'error': str(e),
-                'status': 'error',
-                'days_until_expiry': -1
-            }
+            return self._error_cert_info(domain, str(e))
+    
+    async def _fetch_cert_info_async(self, domain, port=443):
+        """Non-blocking equivalent of fetch_cert_info"""
+        reader, writer = await asyncio.open_connection(
+            domain, port, ssl=self._ssl_ctx, server_hostname=domain)
+        try:
+            self._peer_addresses[domain] = writer.get_extra_info('peername')[0]
+            return self._build_cert_info(domain, writer.get_extra_info('ssl_object'))
+        finally:
+            # Drop the connection without a TLS shutdown, like the sync path;
+            # waiting on close_notify could outlast the probe timeout
+            writer.transport.abort()
+    
+    async def _shared_cert_info(self, domain, port=443):
+        """Reuse a certificate already seen this run whose SANs cover domain,
+        as long as domain resolves to the address that served it"""
+        candidates = [(cert_info, address) for cert_info, address in self._by_fingerprint.values()
+                      if _san_covers(cert_info['san_domains'], domain)]
+        if not candidates:
+            return None
+        
+        try:
+            infos = await asyncio.wait_for(
+                asyncio.get_running_loop().getaddrinfo(domain, port, type=socket.SOCK_STREAM),
+                timeout=10)
+        except (OSError, asyncio.TimeoutError):
+            return None
+        
+        addresses = {info[4][0] for info in infos}
+        for cert_info, address in candidates:
+            if address in addresses:
+                return dict(cert_info, domain=domain)
+        return None
+    
+    async def _probe(self, domain, semaphore, port=443):
+        """Probe one domain, bounded by the shared semaphore and a timeout"""
+        cert_info = self.cached_cert_info(domain, port)
+        if cert_info is not None:
+            return cert_info
+        
+        # Shared results are not cached, so every domain is still contacted
+        # directly once its own cache entry is written
+        cert_info = await self._shared_cert_info(domain, port)
+        if cert_info is not None:
+            return cert_info
+        
+        async with semaphore:
+            try:
+                cert_info = await asyncio.wait_for(
+                    self._fetch_cert_info_async(domain, port), timeout=10)
+            except asyncio.TimeoutError:
+                cert_info = self._error_cert_info(domain, 'timed out')
+            except Exception as e:
+                cert_info = self._error_cert_info(domain, str(e))
+        
+        if cert_info['status'] == 'valid':
+            self._by_fingerprint.setdefault(
+                cert_info['cert_sha256'], (cert_info, self._peer_addresses.get(domain)))
+        
+        self.store_cert_info(cert_info, port)
+        return cert_info
+    
+    async def _probe_all(self, domains):
+        """Probe all domains concurrently, preserving input order"""
+        semaphore = asyncio.Semaphore(self.config['max_concurrency'])
+        self._by_fingerprint = {}
+        self._peer_addresses = {}
+        
+        # Probe one domain per apex first so that a wildcard or multi-SAN
+        # certificate it returns can cover the remaining domains, which are
+        # then probed concurrently; apex grouping only picks what goes first
+        first, rest = [], []
+        apexes = set()
+        for domain in dict.fromkeys(domains):
+            apex = '.'.join(domain.split('.')[-2:])
+            (rest if apex in apexes else first).append(domain)
+            apexes.add(apex)
+        
+        results = {}
+        for batch in (first, rest):
+            batch_results = await asyncio.gather(
+                *(self._probe(domain, semaphore) for domain in batch))
+            results.update(zip(batch, batch_results))
+        
+        return [results[domain] for domain in domains]
     
     def check_all_certificates(self):
-        """Check all configured domains"""
-        results = []
+        """Check all configured domains concurrently"""
+        domains = self.config['domains']
         
-        for domain in self.config['domains']:
+        for domain in domains:
             print(f"Checking certificate for {domain}...")
-            cert_info = self.get_cert_info(domain)
-            results.append(cert_info)
         
-        return results
+        return asyncio.run(self._probe_all(domains))
     
     def analyze_results(self, results):
         """Analyze certificate results and determine actions needed"""
@@ -130,7 +482,8 @@ class SSLCertMonitor:
             return
         
         try:
-            import requests
+            import urllib.error
+            import urllib.request
             
             message = "SSL Certificate Alert:\n"
             for alert in alerts:
@@ -143,14 +496,19 @@ class SSLCertMonitor:
                 "icon_emoji": ":lock:"
             }
             
-            response = requests.post(self.config['slack_webhook'], 
-                                   json=payload, timeout=10)
+            request = urllib.request.Request(
+                self.config['slack_webhook'],
+                data=json.dumps(payload).encode(),
+                headers={'Content-Type': 'application/json'})
             
-            if response.status_code == 200:
-                print("Slack alert sent successfully")
-            else:
-                print(f"Failed to send Slack alert: {response.status_code}")
+            with urllib.request.urlopen(request, timeout=10) as response:
+                if response.status == 200:
+                    print("Slack alert sent successfully")
+                else:
+                    print(f"Failed to send Slack alert: {response.status}")
                 
+        except urllib.error.HTTPError as e:
+            print(f"Failed to send Slack alert: {e.code}")
         except Exception as e:
             print(f"Error sending Slack alert: {e}")
     
@@ -160,6 +518,12 @@ class SSLCertMonitor:
             print(f"Auto-renewal disabled for {domain}")
             return False
         
+        backoff = self._renew_backoff.get(domain)
+        if backoff and time.time() < backoff['next_retry']:
+            retry_at = datetime.fromtimestamp(backoff['next_retry']).strftime('%Y-%m-%d %H:%M:%S')
+            print(f"Skipping renewal for {domain}: previous attempt failed, retrying after {retry_at}")
+            return False
+        
         try:
             print(f"Attempting to renew certificate for {domain}...")
             
@@ -177,16 +541,19 @@ class SSLCertMonitor:
             
             if result.returncode == 0:
                 print(f"Successfully renewed certificate for {domain}")
+                self._renew_backoff.pop(domain, None)
                 
                 # Reload nginx/apache if needed
                 self.reload_web_server()
                 return True
             else:
                 print(f"Failed to renew certificate for {domain}: {result.stderr}")
+                self._record_renew_failure(domain)
                 return False
                 
         except Exception as e:
             print(f"Error renewing certificate for {domain}: {e}")
+            self._record_renew_failure(domain)
             return False
     
     def reload_web_server(self):
@@ -209,23 +576,39 @@ class SSLCertMonitor:
         except Exception as e:
             print(f"Warning: Could not reload web server: {e}")
     
-    def log_results(self, results, alerts):
+    def log_results(self, results, alerts, timestamp=None):
         """Log results to file"""
+        # Only the expiry-relevant fields are logged; full certificate
+        # details are available through --output json
         log_entry = {
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': timestamp or datetime.now().isoformat(),
             'hostname': socket.gethostname(),
-            'results': results,
+            'results': [self._minimal_cert_record(cert) for cert in results
+                        if cert['status'] == 'valid'],
             'alerts': alerts
         }
         
         try:
-            os.makedirs(os.path.dirname(self.config['log_file']), exist_ok=True)
-            with open(self.config['log_file'], 'a') as f:
-                f.write(json.dumps(log_entry) + '\n')
+            if self._log_fp is None:
+                os.makedirs(os.path.dirname(self.config['log_file']), exist_ok=True)
+                if self.config['log_format'] == 'msgpack':
+                    self._log_fp = open(self.config['log_file'], 'ab')
+                else:
+                    self._log_fp = open(self.config['log_file'], 'a', buffering=1)
+                atexit.register(self._log_fp.close)
+            
+            if self.config['log_format'] == 'msgpack':
+                # msgpack records are self-delimiting; read back with msgpack.Unpacker
+                self._log_fp.write(msgpack.packb(log_entry, use_bin_type=True))
+                self._log_fp.flush()
+            else:
+                self._log_fp.write(json.dumps(log_entry, separators=(',', ':')) + '\n')
         except Exception as e:
             print(f"Warning: Could not write to log file: {e}")
 
 def main():
+    import argparse
+    
     parser = argparse.ArgumentParser(description='SSL Certificate Monitor')
     parser.add_argument('--config', default='/etc/ssl-monitor/config.json',
                        help='Configuration file path')
@@ -234,10 +617,17 @@ def main():
                        help='Attempt to renew expiring certificates')
     parser.add_argument('--output', choices=['json', 'human'], default='human',
                        help='Output format')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Always probe domains instead of using cached results')
     
     args = parser.parse_args()
     
-    monitor = SSLCertMonitor(args.config)
+    # Cached entries only hold expiry data, so JSON output always probes to
+    # report full certificate details
+    use_cache = not args.no_cache and args.output != 'json'
+    monitor = SSLCertMonitor(args.config, use_cache=use_cache)
+    now = datetime.now()
+    now_iso = now.isoformat()
     
     # Check specific domain or all domains
     if args.check_domain:
@@ -251,14 +641,14 @@ def main():
     # Output results
     if args.output == 'json':
         output = {
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': now_iso,
             'results': results,
             'alerts': alerts,
             'renewals_needed': renewals_needed
         }
         print(json.dumps(output, indent=2))
     else:
-        print(f"\nSSL Certificate Report - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print(f"\nSSL Certificate Report - {now.strftime('%Y-%m-%d %H:%M:%S')}")
         print("=" * 60)
         
         for cert in results:
@@ -291,7 +681,7 @@ def main():
             monitor.renew_certificate(domain)
     
     # Log results
-    monitor.log_results(results, alerts)
+    monitor.log_results(results, alerts, timestamp=now_iso)
     
     # Exit with error code if critical alerts
     critical_alerts = [a for a in alerts if a['level'] == 'critical']
@@ -8,24 +8,37 @@ import json
 import os
 import sys
 import time
-import subprocess
-import argparse
+import socket
+import threading
 from datetime import datetime
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# (metrics section, key, threshold, warning format); load assumes 4 CPU cores
+_RULES = [
+    ('system', 'memory_used_percent', 90, 'High memory usage: {v:.1f}%'),
+    ('disk', 'disk_used_percent', 85, 'High disk usage: {v:.1f}%'),
+    ('cpu', 'load_1min', 4.0, 'High load average: {v}'),
+]
+
 def get_system_info():
     """Collect basic system information"""
     try:
+        # Parse memory info into a dict in a single pass; kB fields are
+        # converted to bytes, unitless fields (HugePages_*) stay counts
+        meminfo = {}
         with open('/proc/meminfo', 'r') as f:
-            meminfo = f.read()
+            for line in f:
+                name, _, rest = line.partition(':')
+                fields = rest.split()
+                value = int(fields[0])
+                meminfo[name] = value * 1024 if fields[1:] == ['kB'] else value
         
-        # Parse memory info
-        mem_total = 0
-        mem_available = 0
-        for line in meminfo.split('\n'):
-            if 'MemTotal:' in line:
-                mem_total = int(line.split()[1]) * 1024  # Convert KB to bytes
-            elif 'MemAvailable:' in line:
-                mem_available = int(line.split()[1]) * 1024
+        mem_total = meminfo.get('MemTotal', 0)
+        mem_available = meminfo.get('MemAvailable', 0)
         
         mem_used_percent = ((mem_total - mem_available) / mem_total) * 100 if mem_total > 0 else 0
         
@@ -40,24 +53,18 @@ def get_system_info():
 def get_disk_usage():
     """Get disk usage information"""
     try:
-        result = subprocess.run(['df', '-B1', '/'], capture_output=True, text=True)
-        if result.returncode == 0:
-            lines = result.stdout.strip().split('\n')
-            if len(lines) >= 2:
-                parts = lines[1].split()
-                total = int(parts[1])
-                used = int(parts[2])
-                available = int(parts[3])
-                used_percent = (used / total) * 100 if total > 0 else 0
-                
-                return {
-                    'disk_total_bytes': total,
-                    'disk_used_bytes': used,
-                    'disk_available_bytes': available,
-                    'disk_used_percent': round(used_percent, 2)
-                }
+        st = os.statvfs('/')
+        total = st.f_blocks * st.f_frsize
+        used = (st.f_blocks - st.f_bfree) * st.f_frsize
+        available = st.f_bavail * st.f_frsize
+        used_percent = (used / total) * 100 if total > 0 else 0
         
-        return {'error': 'Failed to parse df output'}
+        return {
+            'disk_total_bytes': total,
+            'disk_used_bytes': used,
+            'disk_available_bytes': available,
+            'disk_used_percent': round(used_percent, 2)
+        }
     except Exception as e:
         return {'error': f'Failed to get disk usage: {str(e)}'}
 
@@ -76,6 +83,24 @@ def get_cpu_info():
     except Exception as e:
         return {'error': f'Failed to get CPU info: {str(e)}'}
 
+def dns_resolves(hostname, timeout=3):
+    """Check DNS resolution of hostname, giving up after timeout seconds"""
+    # The resolver ignores socket timeouts, so run it in a daemon thread
+    # and stop waiting for it rather than stalling the caller
+    outcome = {}
+    
+    def lookup():
+        try:
+            socket.getaddrinfo(hostname, None)
+            outcome['ok'] = True
+        except OSError:
+            outcome['ok'] = False
+    
+    worker = threading.Thread(target=lookup, daemon=True)
+    worker.start()
+    worker.join(timeout)
+    return outcome.get('ok', False)
+
 def get_network_info():
     """Get basic network connectivity info"""
     try:
@@ -83,14 +108,14 @@ def get_network_info():
         connectivity = {}
         
         # Test DNS resolution
-        result = subprocess.run(['nslookup', 'google.com'], 
-                              capture_output=True, text=True, timeout=5)
-        connectivity['dns_working'] = result.returncode == 0
+        connectivity['dns_working'] = dns_resolves('google.com', timeout=3)
         
-        # Test internet connectivity
-        result = subprocess.run(['ping', '-c', '1', '-W', '3', '8.8.8.8'], 
-                              capture_output=True, text=True, timeout=10)
-        connectivity['internet_reachable'] = result.returncode == 0
+        # Test internet connectivity with a TCP connect to a public resolver
+        try:
+            with socket.create_connection(('8.8.8.8', 53), timeout=3):
+                connectivity['internet_reachable'] = True
+        except OSError:
+            connectivity['internet_reachable'] = False
         
         return connectivity
     except Exception as e:
@@ -99,15 +124,19 @@ def get_network_info():
 def check_services():
     """Check status of common services"""
     services = ['sshd', 'systemd-resolved', 'cron']
-    service_status = {}
+    service_status = {service: False for service in services}
     
-    for service in services:
-        try:
-            result = subprocess.run(['systemctl', 'is-active', service], 
-                                  capture_output=True, text=True)
-            service_status[service] = result.stdout.strip() == 'active'
-        except Exception:
-            service_status[service] = False
+    try:
+        import subprocess
+        
+        # systemctl prints one state line per unit, in argument order
+        result = subprocess.run(['systemctl', 'is-active'] + services,
+                              capture_output=True, text=True)
+        states = result.stdout.split('\n')
+        for service, state in zip(services, states):
+            service_status[service] = state.strip() == 'active'
+    except Exception:
+        pass
     
     return service_status
 
@@ -132,20 +161,11 @@ def check_thresholds(metrics):
     """Check if any metrics exceed warning thresholds"""
     warnings = []
     
-    # Memory threshold
-    if 'memory_used_percent' in metrics['system']:
-        if metrics['system']['memory_used_percent'] > 90:
-            warnings.append(f"High memory usage: {metrics['system']['memory_used_percent']:.1f}%")
-    
-    # Disk threshold
-    if 'disk_used_percent' in metrics['disk']:
-        if metrics['disk']['disk_used_percent'] > 85:
-            warnings.append(f"High disk usage: {metrics['disk']['disk_used_percent']:.1f}%")
-    
-    # Load average threshold (assuming 4 CPU cores)
-    if 'load_1min' in metrics['cpu']:
-        if metrics['cpu']['load_1min'] > 4.0:
-            warnings.append(f"High load average: {metrics['cpu']['load_1min']}")
+    # Memory, disk and load thresholds
+    for section, key, threshold, message in _RULES:
+        value = metrics[section].get(key)
+        if value is not None and value > threshold:
+            warnings.append(message.format(v=value))
     
     # Network connectivity
     if 'internet_reachable' in metrics['network']:
@@ -174,10 +194,14 @@ def send_to_monitoring_system(metrics):
         print("No monitoring endpoint configured")
 
 def main():
+    import argparse
+    
     parser = argparse.ArgumentParser(description='System Monitor Agent')
     parser.add_argument('--output', choices=['json', 'human'], default='human',
                        help='Output format')
     parser.add_argument('--log-file', help='Log file path')
+    parser.add_argument('--log-format', choices=['json', 'msgpack'], default='json',
+                       help='Log record encoding (msgpack requires the msgpack package)')
     parser.add_argument('--daemon', action='store_true',
                        help='Run as daemon (continuous monitoring)')
     parser.add_argument('--interval', type=int, default=60,
@@ -185,6 +209,20 @@ def main():
     
     args = parser.parse_args()
     
+    if args.interval <= 0:
+        parser.error('--interval must be a positive number of seconds')
+    
+    if args.log_format == 'msgpack' and msgpack is None:
+        parser.error('--log-format msgpack requires the msgpack package')
+    
+    # Opened once so daemon mode does not reopen it every cycle
+    if not args.log_file:
+        log_fp = None
+    elif args.log_format == 'msgpack':
+        log_fp = open(args.log_file, 'ab')
+    else:
+        log_fp = open(args.log_file, 'a', buffering=1)
+    
     def run_monitoring():
         """Single monitoring run"""
         metrics = collect_metrics()
@@ -230,17 +268,20 @@ def main():
                 print("\nAll systems normal")
         
         # Log to file if specified
-        if args.log_file:
-            with open(args.log_file, 'a') as f:
-                log_entry = {
-                    'timestamp': metrics['timestamp'],
-                    'hostname': metrics['hostname'],
-                    'warnings': warnings,
-                    'memory_percent': metrics['system'].get('memory_used_percent'),
-                    'disk_percent': metrics['disk'].get('disk_used_percent'),
-                    'load_avg': metrics['cpu'].get('load_1min')
-                }
-                f.write(json.dumps(log_entry) + '\n')
+        if log_fp:
+            log_entry = {
+                'timestamp': metrics['timestamp'],
+                'hostname': metrics['hostname'],
+                'warnings': warnings,
+                'memory_percent': metrics['system'].get('memory_used_percent'),
+                'disk_percent': metrics['disk'].get('disk_used_percent'),
+                'load_avg': metrics['cpu'].get('load_1min')
+            }
+            if args.log_format == 'msgpack':
+                log_fp.write(msgpack.packb(log_entry, use_bin_type=True))
+                log_fp.flush()
+            else:
+                log_fp.write(json.dumps(log_entry, separators=(',', ':')) + '\n')
         
         # Send to monitoring system
         send_to_monitoring_system(metrics)
@@ -248,17 +289,30 @@ def main():
         # Return exit code based on warnings
         return 1 if warnings else 0
     
-    if args.daemon:
-        print(f"Starting system monitor daemon (interval: {args.interval}s)")
-        try:
-            while True:
-                run_monitoring()
-                time.sleep(args.interval)
-        except KeyboardInterrupt:
-            print("\nDaemon stopped")
-            return 0
-    else:
-        return run_monitoring()
+    try:
+        if args.daemon:
+            print(f"Starting system monitor daemon (interval: {args.interval}s)")
+            # Schedule runs on fixed ticks from start so slow runs do not
+            # push later ones back; ticks missed entirely are skipped
+            start = time.monotonic()
+            tick = 0
+            try:
+                while True:
+                    run_monitoring()
+                    tick += 1
+                    delay = start + tick * args.interval - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        tick = int((time.monotonic() - start) / args.interval)
+            except KeyboardInterrupt:
+                print("\nDaemon stopped")
+                return 0
+        else:
+            return run_monitoring()
+    finally:
+        if log_fp:
+            log_fp.close()
 
 if __name__ == '__main__':
     sys.exit(main())